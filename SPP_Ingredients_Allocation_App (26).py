@@ -1,82 +1,227 @@
 import pandas as pd
+import numpy as np
+import numexpr as ne
 import streamlit as st
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import httplib2
+from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
 from dotenv import load_dotenv
 import os
+import json
+import uuid
+import tempfile
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import plotly.express as px
 
 # Load environment variables
 load_dotenv()
 
-def connect_to_gsheet(spreadsheet_name, sheet_name):
+# On-disk cache of the processed sheet, invalidated by the Drive modifiedTime
+CACHE_DIR = os.getenv("SPP_CACHE_DIR", ".cache")
+CACHE_PARQUET_PATH = os.path.join(CACHE_DIR, "cache.parquet")
+CACHE_META_PATH = os.path.join(CACHE_DIR, "cache_meta.json")
+CACHE_VERSION = 7  # Bump whenever the cached DataFrame's columns or dtypes change
+
+@st.cache_resource
+def get_google_services():
+    """
+    Authenticate once per server process and build the Sheets and Drive API clients.
+    Returns a (credentials, sheets_service, drive_service) tuple.
+    """
+    scope = ["https://www.googleapis.com/auth/spreadsheets.readonly",
+             "https://www.googleapis.com/auth/drive.metadata.readonly"]
+    
+    credentials = {
+        "type": "service_account",
+        "project_id": os.getenv("GOOGLE_PROJECT_ID"),
+        "private_key_id": os.getenv("GOOGLE_PRIVATE_KEY_ID"),
+        "private_key": os.getenv("GOOGLE_PRIVATE_KEY").replace("\\n", "\n"),
+        "client_email": os.getenv("GOOGLE_CLIENT_EMAIL"),
+        "client_id": os.getenv("GOOGLE_CLIENT_ID"),
+        "auth_uri": os.getenv("GOOGLE_AUTH_URI"),
+        "token_uri": os.getenv("GOOGLE_TOKEN_URI"),
+        "auth_provider_x509_cert_url": os.getenv("GOOGLE_AUTH_PROVIDER_X509_CERT_URL"),
+        "client_x509_cert_url": os.getenv("GOOGLE_CLIENT_X509_CERT_URL")
+    }
+
+    client_credentials = Credentials.from_service_account_info(credentials, scopes=scope)
+    sheets_service = build("sheets", "v4", credentials=client_credentials, cache_discovery=False)
+    drive_service = build("drive", "v3", credentials=client_credentials, cache_discovery=False)
+    return client_credentials, sheets_service, drive_service
+
+def connect_to_gsheet():
     """
-    Authenticate and connect to Google Sheets.
+    Get the authorized Google API clients, or None on failure.
     """
-    scope = ["https://spreadsheets.google.com/feeds", 
-             "https://www.googleapis.com/auth/spreadsheets",
-             "https://www.googleapis.com/auth/drive.file", 
-             "https://www.googleapis.com/auth/drive"]
+    if not SPREADSHEET_ID:
+        st.error("GOOGLE_SPREADSHEET_ID is not set. Add the ID of the stock management spreadsheet to the environment.")
+        return None
     
     try:
-        credentials = {
-            "type": "service_account",
-            "project_id": os.getenv("GOOGLE_PROJECT_ID"),
-            "private_key_id": os.getenv("GOOGLE_PRIVATE_KEY_ID"),
-            "private_key": os.getenv("GOOGLE_PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("GOOGLE_CLIENT_EMAIL"),
-            "client_id": os.getenv("GOOGLE_CLIENT_ID"),
-            "auth_uri": os.getenv("GOOGLE_AUTH_URI"),
-            "token_uri": os.getenv("GOOGLE_TOKEN_URI"),
-            "auth_provider_x509_cert_url": os.getenv("GOOGLE_AUTH_PROVIDER_X509_CERT_URL"),
-            "client_x509_cert_url": os.getenv("GOOGLE_CLIENT_X509_CERT_URL")
-        }
-
-        client_credentials = ServiceAccountCredentials.from_json_keyfile_dict(credentials, scope)
-        client = gspread.authorize(client_credentials)
-        spreadsheet = client.open(spreadsheet_name)  
-        return spreadsheet.worksheet(sheet_name)  # Access specific sheet by name
+        return get_google_services()
     except Exception as e:
         st.error(f"Failed to connect to Google Sheets: {e}")
         return None
 
+def execute_request(request, credentials):
+    """
+    Execute a Google API request on its own authorized connection, since httplib2
+    connections must not be shared between Streamlit session threads.
+    """
+    return request.execute(http=AuthorizedHttp(credentials, http=httplib2.Http()))
+
+def fetch_sheet_dataframe(services):
+    """
+    Fetch the columns the app uses from the sheet and convert them to a typed DataFrame.
+    """
+    credentials, sheets_service, _ = services
+    
+    # Fetch columns A:H (DATE through ITEM_CATEGORY) by spreadsheet ID in a single values request.
+    # Unformatted values keep numbers numeric; dates stay as formatted strings.
+    request = sheets_service.spreadsheets().values().get(
+        spreadsheetId=SPREADSHEET_ID,
+        range=f"{SHEET_NAME}!A:H",
+        valueRenderOption="UNFORMATTED_VALUE",
+        dateTimeRenderOption="FORMATTED_STRING"
+    )
+    rows = execute_request(request, credentials).get("values", [])
+    
+    if len(rows) < 2:
+        st.error("No data found in the Google Sheet.")
+        return None
+    
+    # Build the DataFrame directly from header row + body rows.
+    # The API omits trailing empty cells, so pad the short rows back out with blanks
+    # (leaving None gaps would turn whole-number serials into floats like "1001.0").
+    header = rows[0]
+    body = [row + [""] * (len(header) - len(row)) for row in rows[1:]]
+    df = pd.DataFrame(body, columns=header)
+    
+    # Ensure columns match the updated Google Sheets structure
+    df.columns = ["DATE", "ITEM_SERIAL", "ITEM NAME", "DEPARTMENT", "ISSUED_TO", "QUANTITY", 
+                "UNIT_OF_MEASURE", "ITEM_CATEGORY"]
+    
+    # Keep only the columns the app reads
+    df = df[["DATE", "ITEM_SERIAL", "ITEM NAME", "DEPARTMENT", "QUANTITY", "UNIT_OF_MEASURE", "ITEM_CATEGORY"]]
+    
+    # Unformatted cells can mix numbers and text; keep descriptive columns as text
+    # so the frame serializes cleanly to the parquet cache
+    text_columns = df.columns.difference(["DATE", "QUANTITY"])
+    df[text_columns] = df[text_columns].astype(str)
+    
+    # Convert date and numeric columns (blank cells arrive as "", so coerce)
+    df["DATE"] = pd.to_datetime(df["DATE"], errors="coerce")
+    df["QUANTITY"] = pd.to_numeric(df["QUANTITY"], errors="coerce", downcast="float")
+    df.dropna(subset=["QUANTITY"], inplace=True)
+    df["QUANTITY"] = df["QUANTITY"].astype("float32")  # Quantities are small; halves memory traffic
+    
+    # Low-cardinality text columns group and filter on integer codes as categoricals
+    for column in ["DEPARTMENT", "ITEM NAME", "ITEM_CATEGORY", "UNIT_OF_MEASURE"]:
+        df[column] = df[column].astype("category")
+    
+    # Store the remaining free-text column as a contiguous Arrow string array
+    df["ITEM_SERIAL"] = df["ITEM_SERIAL"].astype("string[pyarrow]")
+    
+    # Integer month code (months since 1970-01) for fast monthly grouping;
+    # the quarter is MONTH_CODE // 3 when needed
+    df["MONTH_CODE"] = df["DATE"].to_numpy().astype("datetime64[M]").astype(np.int32)
+    
+    return df
+
+def get_sheet_modified_time(services):
+    """
+    Get the spreadsheet's last modified time from the Drive API, or None if unavailable.
+    """
+    credentials, _, drive_service = services
+    try:
+        request = drive_service.files().get(fileId=SPREADSHEET_ID, fields="modifiedTime")
+        return execute_request(request, credentials)["modifiedTime"]
+    except Exception:
+        return None
+
+def read_parquet_cache(modified_time):
+    """
+    Load the cached DataFrame if it was written for the given sheet revision.
+    """
+    if modified_time is None or not os.path.exists(CACHE_PARQUET_PATH):
+        return None
+    
+    try:
+        with open(CACHE_META_PATH) as f:
+            meta = json.load(f)
+        if meta.get("modifiedTime") != modified_time or meta.get("version") != CACHE_VERSION:
+            return None
+        # Parquet restores string columns with the default Python storage, so re-apply Arrow
+        return pd.read_parquet(CACHE_PARQUET_PATH).astype({"ITEM_SERIAL": "string[pyarrow]"})
+    except Exception:
+        return None
+
+def write_parquet_cache(df, modified_time):
+    """
+    Save the DataFrame and its sheet revision to the on-disk cache.
+    """
+    if modified_time is None:
+        return
+    
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write each file under a temporary name and swap it into place atomically, parquet
+        # first, so concurrent sessions never see a matching sidecar next to a partial file
+        replace_atomically(CACHE_PARQUET_PATH, lambda path: df.to_parquet(path, index=False))
+        replace_atomically(CACHE_META_PATH, lambda path: write_json(path, {"modifiedTime": modified_time,
+                                                                           "version": CACHE_VERSION}))
+    except Exception as e:
+        st.warning(f"Could not write data cache: {e}")
+
+def write_json(path, payload):
+    """
+    Write a JSON payload to the given path.
+    """
+    with open(path, "w") as f:
+        json.dump(payload, f)
+
+def replace_atomically(target_path, write):
+    """
+    Call write() on a temporary file in the target's directory, then move it over the target.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, target_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
 def load_data_from_google_sheet():
     """
-    Load data from Google Sheets.
+    Load data from Google Sheets, reusing the on-disk cache when the sheet is unchanged.
     """
     with st.spinner("Loading data from Google Sheets..."):
         try:
-            worksheet = connect_to_gsheet(SPREADSHEET_NAME, SHEET_NAME)
-            if worksheet is None:
+            services = connect_to_gsheet()
+            if services is None:
                 return None
             
-            # Get all records from the Google Sheet
-            data = worksheet.get_all_records()
-            
-            if not data:
-                st.error("No data found in the Google Sheet.")
-                return None
-
-            # Convert data to DataFrame
-            df = pd.DataFrame(data)
-
-            # Ensure columns match the updated Google Sheets structure
-            df.columns = ["DATE", "ITEM_SERIAL", "ITEM NAME", "DEPARTMENT", "ISSUED_TO", "QUANTITY", 
-                        "UNIT_OF_MEASURE", "ITEM_CATEGORY", "WEEK", "REFERENCE", 
-                        "DEPARTMENT_CAT", "BATCH NO.", "STORE", "RECEIVED BY"]
-
-            # Convert date and numeric columns
-            df["DATE"] = pd.to_datetime(df["DATE"], errors="coerce")
-            df["QUANTITY"] = pd.to_numeric(df["QUANTITY"], errors="coerce")
-            df.dropna(subset=["QUANTITY"], inplace=True)
-            
-            # Extract quarter information
-            df["QUARTER"] = df["DATE"].dt.to_period("Q")
+            # Skip the full fetch when the sheet has not changed since the last cache write
+            modified_time = get_sheet_modified_time(services)
+            df = read_parquet_cache(modified_time)
+            if df is None:
+                df = fetch_sheet_dataframe(services)
+                if df is None:
+                    return None
+                write_parquet_cache(df, modified_time)
 
             # Filter data for 2024 onwards
             current_year = datetime.now().year
             df = df[df["DATE"].dt.year >= current_year - 1]  # Data from last year onwards
+            
+            # Identify the dataset by sheet revision and year window, so every session
+            # holding the same data shares cache entries keyed on it
+            if modified_time is not None:
+                df.attrs["data_version"] = f"{modified_time}:{current_year}"
 
             return df
         except Exception as e:
@@ -87,7 +232,32 @@ def load_data_from_google_sheet():
 def get_cached_data():
     return load_data_from_google_sheet()
 
-def calculate_proportion(df, identifier, department=None, min_proportion=0.1):
+@st.cache_data
+def build_item_dept_totals(df):
+    """
+    Total quantity per (item, department), computed once per dataset for allocation lookups.
+    """
+    return df.groupby(["ITEM NAME", "DEPARTMENT"], observed=True)["QUANTITY"].sum()
+
+@st.cache_data
+def build_serial_to_name(df):
+    """
+    Map lowercase item serials to their item names.
+    """
+    return dict(zip(df["ITEM_SERIAL"].str.lower(), df["ITEM NAME"]))
+
+@st.cache_data
+def build_item_name_lookup(item_dept_totals):
+    """
+    Map lowercase item names to the item names (all case variants) present in the totals table.
+    """
+    lookup = {}
+    for item_name in item_dept_totals.index.levels[0]:
+        lookup.setdefault(item_name.lower(), []).append(item_name)
+    return lookup
+
+def calculate_proportion(df, identifier, department=None, min_proportion=0.1,
+                         item_dept_totals=None, serial_to_name=None, item_name_lookup=None):
     """
     Calculate department-wise usage proportion, ensuring all departments sum to 100%.
     Filters out departments with proportions less than min_proportion.
@@ -96,31 +266,46 @@ def calculate_proportion(df, identifier, department=None, min_proportion=0.1):
         return None
     
     try:
+        if item_dept_totals is None:
+            item_dept_totals = build_item_dept_totals(df)
+        if serial_to_name is None:
+            serial_to_name = build_serial_to_name(df)
+        if item_name_lookup is None:
+            item_name_lookup = build_item_name_lookup(item_dept_totals)
+        
         if identifier.isnumeric():
-            filtered_df = df[df["ITEM_SERIAL"].astype(str).str.lower() == identifier.lower()]
+            # Translate the serial to its item name up front
+            item_name = serial_to_name.get(identifier.lower())
+            matching_items = [item_name] if item_name is not None else []
         else:
-            filtered_df = df[df["ITEM NAME"].str.lower() == identifier.lower()]
+            matching_items = item_name_lookup.get(identifier.lower(), [])
 
-        if filtered_df.empty:
+        if len(matching_items) == 0:
             return None
 
+        # Slice the precomputed per-department totals for the matched item(s)
+        dept_totals = pd.concat([item_dept_totals.loc[item_name] for item_name in matching_items])
+        if len(matching_items) > 1:
+            dept_totals = dept_totals.groupby(level="DEPARTMENT", observed=True, sort=False).sum()
+
         # Apply department filter if specified
         if department and department != "All Departments":
-            filtered_df = filtered_df[filtered_df["DEPARTMENT"] == department]
-            if filtered_df.empty:
+            dept_totals = dept_totals[dept_totals.index == department]
+            if dept_totals.empty:
                 return None
 
-        # Calculate department-level proportions
-        dept_usage = filtered_df.groupby("DEPARTMENT")["QUANTITY"].sum().reset_index()
+        dept_usage = dept_totals.reset_index()
         
         # Calculate total across all departments - this ensures proportions sum to 100%
-        total_usage = dept_usage["QUANTITY"].sum()
+        # Accumulate in float64 to guard precision of the float32 quantities
+        quantities = dept_usage["QUANTITY"].to_numpy(dtype=np.float64)
+        total_usage = quantities.sum()
         
         if total_usage == 0:
             return None
             
         # Calculate each department's proportion of the total
-        dept_usage["PROPORTION"] = (dept_usage["QUANTITY"] / total_usage) * 100
+        dept_usage["PROPORTION"] = (quantities / total_usage) * 100
         
         # Filter out departments with proportions less than min_proportion
         significant_depts = dept_usage[dept_usage["PROPORTION"] >= min_proportion].copy()
@@ -141,31 +326,47 @@ def calculate_proportion(df, identifier, department=None, min_proportion=0.1):
         st.error(f"Error calculating proportions: {e}")
         return None
 
-def allocate_quantity(df, identifier, available_quantity, department=None):
+def allocate_quantity(df, identifier, available_quantity, department=None,
+                      item_dept_totals=None, serial_to_name=None, item_name_lookup=None):
     """
     Allocate quantity based on historical proportions at department level.
     """
-    proportions = calculate_proportion(df, identifier, department)
+    proportions = calculate_proportion(df, identifier, department, item_dept_totals=item_dept_totals,
+                                       serial_to_name=serial_to_name, item_name_lookup=item_name_lookup)
     if proportions is None:
         return None
     
     # Calculate allocated quantity for each department based on their proportion
-    proportions["ALLOCATED_QUANTITY"] = (proportions["PROPORTION"] / 100) * available_quantity
+    raw_allocation = (proportions["PROPORTION"].to_numpy() / 100) * available_quantity
     
-    # Round allocated quantities
-    proportions["ALLOCATED_QUANTITY"] = proportions["ALLOCATED_QUANTITY"].round(0)
+    # Largest-remainder rounding: floor everything, then give the leftover units
+    # to the departments with the largest fractional parts so the total matches exactly
+    allocation = np.floor(raw_allocation)
+    remainders = raw_allocation - allocation
+    leftover = int(round(available_quantity - allocation.sum()))
+    if leftover > 0:
+        allocation[np.argpartition(-remainders, leftover - 1)[:leftover]] += 1
     
-    # Ensure the sum matches the available quantity exactly
-    allocated_sum = proportions["ALLOCATED_QUANTITY"].sum()
-    if abs(allocated_sum - available_quantity) > 0.01 and len(proportions) > 0:  # Allow small rounding error
-        difference = int(available_quantity - allocated_sum)
-        if difference != 0:
-            # Add/subtract the difference from the largest allocation
-            index_max = proportions["ALLOCATED_QUANTITY"].idxmax()
-            proportions.at[index_max, "ALLOCATED_QUANTITY"] += difference
+    proportions["ALLOCATED_QUANTITY"] = allocation
     
     return proportions
 
+def format_allocation_result(result):
+    """
+    Format allocation results for display and download.
+    """
+    formatted_result = result[["DEPARTMENT", "PROPORTION", "ALLOCATED_QUANTITY"]].rename(columns={
+        "DEPARTMENT": "Department",
+        "PROPORTION": "Proportion (%)",
+        "ALLOCATED_QUANTITY": "Allocated Quantity"
+    })
+    
+    # Format numeric columns
+    formatted_result["Proportion (%)"] = formatted_result["Proportion (%)"].round(2)
+    formatted_result["Allocated Quantity"] = formatted_result["Allocated Quantity"].astype(int)
+    
+    return formatted_result
+
 def generate_allocation_chart(result_df, item_name):
     """
     Generate a bar chart for allocation results.
@@ -196,75 +397,186 @@ def generate_allocation_chart(result_df, item_name):
     
     return fig
 
-def generate_usage_charts(df, selected_items=None, selected_departments=None, date_range=None):
+def build_filter_mask(df, date_range=None, categories=None, items=None, departments=None):
     """
-    Generate charts for historical usage analysis.
+    Combine the selected filters into a single boolean row mask.
+    The predicates are fused by numexpr into one pass instead of a chain of temporary arrays.
     """
-    # Apply filters
-    filtered_data = df.copy()
-    
-    if date_range:
-        filtered_data = filtered_data[(filtered_data["DATE"].dt.date >= date_range[0]) & 
-                                     (filtered_data["DATE"].dt.date <= date_range[1])]
-    if selected_items:
-        filtered_data = filtered_data[filtered_data["ITEM NAME"].isin(selected_items)]
-    if selected_departments and "All Departments" not in selected_departments:
-        filtered_data = filtered_data[filtered_data["DEPARTMENT"].isin(selected_departments)]
-    
-    charts = {}
-    
-    # Department usage pie chart
-    dept_usage = filtered_data.groupby("DEPARTMENT")["QUANTITY"].sum().reset_index()
-    dept_usage.sort_values(by="QUANTITY", ascending=False, inplace=True)
+    operands = {}
+    terms = []
+    
+    if date_range and len(date_range) == 2:
+        # Compare native datetime64 values as int64 nanoseconds against day bounds; the end date is inclusive
+        operands["dates"] = df["DATE"].to_numpy().view(np.int64)
+        operands["start"] = np.datetime64(date_range[0], "D").astype("datetime64[ns]").astype(np.int64)
+        operands["end"] = (np.datetime64(date_range[1], "D") + np.timedelta64(1, "D")).astype("datetime64[ns]").astype(np.int64)
+        terms.append("(dates >= start) & (dates < end)")
+    if categories:
+        operands["in_categories"] = df["ITEM_CATEGORY"].isin(categories).to_numpy()
+        terms.append("in_categories")
+    if items:
+        operands["in_items"] = df["ITEM NAME"].isin(items).to_numpy()
+        terms.append("in_items")
+    if departments:
+        operands["in_departments"] = df["DEPARTMENT"].isin(departments).to_numpy()
+        terms.append("in_departments")
+    
+    if not terms:
+        return np.ones(len(df), dtype=bool)
+    
+    return ne.evaluate(" & ".join(terms), local_dict=operands)
+
+@st.cache_data
+def build_usage_aggregates(df):
+    """
+    Daily quantity totals, overall and per department, item and category,
+    so unfiltered Historical Usage charts can skip regrouping the full data.
+    """
+    day = df["DATE"].dt.normalize()
+    aggregates = {"DATE": df.groupby(day)["QUANTITY"].sum()}
+    for column in ["DEPARTMENT", "ITEM NAME", "ITEM_CATEGORY"]:
+        aggregates[column] = df.groupby([day, df[column]], observed=True)["QUANTITY"].sum()
+    return aggregates
+
+def generate_dept_pie(dept_usage):
+    """
+    Generate the department usage pie chart from a Series of quantities indexed by department.
+    """
+    dept_usage = dept_usage.sort_values(ascending=False)
     
-    charts["dept_pie"] = px.pie(
-        dept_usage, 
-        values="QUANTITY", 
-        names="DEPARTMENT", 
+    return px.pie(
+        values=dept_usage.values, 
+        names=dept_usage.index.astype(str), 
         title="Usage Distribution by Department",
+        labels={"names": "DEPARTMENT", "values": "QUANTITY"},
         hole=0.4
     )
+
+def generate_monthly_trend(monthly_usage):
+    """
+    Generate the monthly usage trend line chart from a Series of quantities indexed by month code.
+    """
+    # Format the month codes as YYYY-MM labels only on the small aggregate
+    months = monthly_usage.index.to_numpy().astype("datetime64[M]").astype(str)
     
-    # Monthly trend chart
-    filtered_data["MONTH"] = filtered_data["DATE"].dt.to_period("M")
-    monthly_usage = filtered_data.groupby(["MONTH"])["QUANTITY"].sum().reset_index()
-    monthly_usage["MONTH"] = monthly_usage["MONTH"].astype(str)
-    
-    charts["monthly_trend"] = px.line(
-        monthly_usage,
-        x="MONTH",
-        y="QUANTITY",
+    return px.line(
+        x=months,
+        y=monthly_usage.values,
         title="Monthly Usage Trend",
+        labels={"x": "MONTH", "y": "QUANTITY"},
         markers=True
     )
+
+def generate_top_items_chart(item_usage):
+    """
+    Generate the top 10 items bar chart from a Series of quantities indexed by item name.
+    """
+    # Partial selection of the 10 largest instead of sorting every item
+    top_items = item_usage.nlargest(10)
     
-    # Top items chart
-    item_usage = filtered_data.groupby("ITEM NAME")["QUANTITY"].sum().reset_index()
-    item_usage.sort_values(by="QUANTITY", ascending=False, inplace=True)
-    top_items = item_usage.head(10)
-    
-    charts["top_items"] = px.bar(
-        top_items,
-        x="ITEM NAME",
-        y="QUANTITY",
+    return px.bar(
+        x=top_items.index.astype(str),
+        y=top_items.values,
         title="Top 10 Items by Usage Quantity",
+        labels={"x": "ITEM NAME", "y": "QUANTITY"},
         color_discrete_sequence=px.colors.qualitative.Bold
     )
+
+def generate_category_chart(category_usage):
+    """
+    Generate the item category distribution bar chart from a Series of quantities indexed by category.
+    """
+    category_usage = category_usage.sort_values(ascending=False)
+    categories = category_usage.index.astype(str)
     
-    # Item category distribution
-    category_usage = filtered_data.groupby("ITEM_CATEGORY")["QUANTITY"].sum().reset_index()
-    category_usage.sort_values(by="QUANTITY", ascending=False, inplace=True)
-    
-    charts["category_dist"] = px.bar(
-        category_usage,
-        x="ITEM_CATEGORY",
-        y="QUANTITY",
+    return px.bar(
+        x=categories,
+        y=category_usage.values,
         title="Usage by Item Category",
-        color="ITEM_CATEGORY"
+        labels={"x": "ITEM_CATEGORY", "y": "QUANTITY", "color": "ITEM_CATEGORY"},
+        color=categories
     )
+
+def generate_usage_charts(df, selected_items=None, selected_departments=None, date_range=None,
+                          usage_aggregates=None):
+    """
+    Generate charts for historical usage analysis.
+    """
+    if selected_departments and "All Departments" in selected_departments:
+        selected_departments = None
+    
+    if (usage_aggregates is not None and not selected_items and not selected_departments
+            and date_range and len(date_range) == 2):
+        # Only a date range is applied, so re-sum the prebuilt daily totals over it
+        start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+        daily_usage = usage_aggregates["DATE"].loc[start:end]
+        
+        def usage_by(column):
+            return usage_aggregates[column].loc[start:end].groupby(level=column, observed=True, sort=False).sum()
+        
+        def monthly_usage():
+            month_codes = daily_usage.index.to_numpy().astype("datetime64[M]").astype(np.int32)
+            return daily_usage.groupby(month_codes).sum()
+    else:
+        # Apply filters in a single selection of the columns the charts use
+        mask = build_filter_mask(df, date_range, items=selected_items, departments=selected_departments)
+        filtered_data = df.loc[mask, ["MONTH_CODE", "ITEM NAME", "DEPARTMENT", "ITEM_CATEGORY", "QUANTITY"]]
+        
+        def usage_by(column):
+            return filtered_data.groupby(column, observed=True, sort=False)["QUANTITY"].sum()
+        
+        def monthly_usage():
+            return filtered_data.groupby("MONTH_CODE")["QUANTITY"].sum()
+    
+    # The aggregations and figures are independent, so build them concurrently;
+    # pandas releases the GIL during its grouped reductions
+    chart_builders = {
+        "dept_pie": lambda: generate_dept_pie(usage_by("DEPARTMENT")),
+        "monthly_trend": lambda: generate_monthly_trend(monthly_usage()),
+        "top_items": lambda: generate_top_items_chart(usage_by("ITEM NAME")),
+        "category_dist": lambda: generate_category_chart(usage_by("ITEM_CATEGORY")),
+    }
+    with ThreadPoolExecutor(max_workers=len(chart_builders)) as executor:
+        futures = {name: executor.submit(builder) for name, builder in chart_builders.items()}
+        charts = {name: future.result() for name, future in futures.items()}
     
     return charts
 
+@st.cache_data(max_entries=32)
+def apply_overview_filters(_df, data_version, date_range, categories, items, departments):
+    """
+    Filter the data for the Data Overview tab and compute its usage statistics.
+    The frame is excluded from the cache key; data_version (the sheet revision) identifies it instead.
+    """
+    display_columns = ["DATE", "ITEM NAME", "DEPARTMENT", "QUANTITY", "UNIT_OF_MEASURE", "ITEM_CATEGORY"]
+    mask = build_filter_mask(_df, date_range, categories, items, departments)
+    filtered_data = _df.loc[mask, display_columns]
+    
+    return {
+        "filtered_data": filtered_data,
+        "total_usage": filtered_data["QUANTITY"].to_numpy(dtype=np.float64).sum(),
+        "unique_items_count": filtered_data["ITEM NAME"].nunique(),
+        "transactions": len(filtered_data),
+    }
+
+def store_data_in_session(df):
+    """
+    Store the loaded data and the lookup tables derived from it in the session state.
+    """
+    st.session_state.data = df
+    if df is not None:
+        # Fall back to a one-off version when the sheet revision is unknown
+        st.session_state.data_version = df.attrs.get("data_version") or uuid.uuid4().hex
+        st.session_state.item_dept_totals = build_item_dept_totals(df)
+        st.session_state.serial_to_name = build_serial_to_name(df)
+        st.session_state.item_name_lookup = build_item_name_lookup(st.session_state.item_dept_totals)
+        st.session_state.usage_aggregates = build_usage_aggregates(df)
+        
+        # Unique filter options, computed once per dataset rather than on every rerun
+        st.session_state.unique_item_names = sorted(df["ITEM NAME"].unique().tolist())
+        st.session_state.unique_categories = sorted(df["ITEM_CATEGORY"].unique().tolist())
+        st.session_state.unique_departments = sorted(["All Departments"] + df["DEPARTMENT"].unique().tolist())
+
 # Streamlit UI
 st.set_page_config(
     page_title="SPP Ingredients Allocation App", 
@@ -350,12 +662,19 @@ with st.sidebar:
     st.markdown("<h2 class='title'>SPP Ingredients Allocation</h2>", unsafe_allow_html=True)
     
     # Google Sheet credentials and details
-    SPREADSHEET_NAME = 'BROWNS STOCK MANAGEMENT'
+    SPREADSHEET_ID = os.getenv("GOOGLE_SPREADSHEET_ID")  # ID of the 'BROWNS STOCK MANAGEMENT' spreadsheet
     SHEET_NAME = 'CHECK_OUT'
     
     # Load the data
     if "data" not in st.session_state:
-        st.session_state.data = get_cached_data()
+        store_data_in_session(get_cached_data())
+    
+    # Refresh data button; handled before the data is read so the rest of the run
+    # uses the refreshed data together with its version and derived lookups
+    if st.button("Refresh Data"):
+        store_data_in_session(load_data_from_google_sheet())
+        if st.session_state.data is not None:
+            st.success("Data refreshed successfully!")
     
     data = st.session_state.data
     
@@ -364,19 +683,14 @@ with st.sidebar:
         st.stop()
     
     # Extract unique item names, categories, and departments for filtering
-    unique_item_names = sorted(data["ITEM NAME"].unique().tolist())
-    unique_categories = sorted(data["ITEM_CATEGORY"].unique().tolist())
-    unique_departments = sorted(["All Departments"] + data["DEPARTMENT"].unique().tolist())
+    unique_item_names = st.session_state.unique_item_names
+    unique_categories = st.session_state.unique_categories
+    unique_departments = st.session_state.unique_departments
     
     st.markdown("### Quick Stats")
     st.metric("Total Items", f"{len(unique_item_names)}")
     st.metric("Total Departments", f"{len(unique_departments) - 1}")  # Exclude "All Departments"
     
-    # Refresh data button
-    if st.button("Refresh Data"):
-        st.session_state.data = load_data_from_google_sheet()
-        st.success("Data refreshed successfully!")
-    
     st.markdown("---")
     st.markdown("<p class='footer'>Developed by Brown's Data Team, ©2025</p>", unsafe_allow_html=True)
 
@@ -408,37 +722,25 @@ with tab1:
             # Multi-select for departments
             selected_overview_dept = st.multiselect("Filter by Departments", unique_departments[1:], default=[])  # Exclude "All Departments"
     
-    # Apply filters
-    filtered_data = data.copy()
-    if date_range:
-        filtered_data = filtered_data[(filtered_data["DATE"].dt.date >= date_range[0]) & 
-                                     (filtered_data["DATE"].dt.date <= date_range[1])]
-    if selected_categories:
-        filtered_data = filtered_data[filtered_data["ITEM_CATEGORY"].isin(selected_categories)]
-    if selected_items:
-        filtered_data = filtered_data[filtered_data["ITEM NAME"].isin(selected_items)]
-    if selected_overview_dept:
-        filtered_data = filtered_data[filtered_data["DEPARTMENT"].isin(selected_overview_dept)]
+    # Apply filters (memoized per filter selection for the loaded dataset)
+    overview = apply_overview_filters(data, st.session_state.data_version, date_range,
+                                      selected_categories, selected_items, selected_overview_dept)
     
     # Show data overview
     st.markdown("#### Filtered Data Preview")
-    display_columns = ["DATE", "ITEM NAME", "DEPARTMENT", "QUANTITY", "UNIT_OF_MEASURE", "ITEM_CATEGORY"]
-    st.dataframe(filtered_data[display_columns], use_container_width=True)
+    st.dataframe(overview["filtered_data"], use_container_width=True)
     st.markdown("</div>", unsafe_allow_html=True)
     
     # Simple statistics
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("#### Usage Statistics")
-    total_usage = filtered_data["QUANTITY"].sum()
-    unique_items_count = filtered_data["ITEM NAME"].nunique()
-    
     stat_col1, stat_col2, stat_col3 = st.columns(3)
     with stat_col1:
-        st.metric("Total Quantity Used", f"{total_usage:,.2f}")
+        st.metric("Total Quantity Used", f"{overview['total_usage']:,.2f}")
     with stat_col2:
-        st.metric("Unique Items", f"{unique_items_count}")
+        st.metric("Unique Items", f"{overview['unique_items_count']}")
     with stat_col3:
-        st.metric("Total Transactions", f"{len(filtered_data):,}")
+        st.metric("Total Transactions", f"{overview['transactions']:,}")
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Tab 2: Allocation Calculator
@@ -474,24 +776,21 @@ with tab2:
         if not entries:
             st.warning("Please enter at least one valid item and quantity!")
         else:
+            # Compute and format every allocation first, then render them
+            allocations = []
             for identifier, available_quantity in entries:
-                result = allocate_quantity(data, identifier, available_quantity, selected_department)
-                if result is not None:
+                result = allocate_quantity(data, identifier, available_quantity, selected_department,
+                                           item_dept_totals=st.session_state.item_dept_totals,
+                                           serial_to_name=st.session_state.serial_to_name,
+                                           item_name_lookup=st.session_state.item_name_lookup)
+                formatted_result = format_allocation_result(result) if result is not None else None
+                allocations.append((identifier, available_quantity, formatted_result))
+            
+            for identifier, available_quantity, formatted_result in allocations:
+                if formatted_result is not None:
                     st.markdown("<div class='card'>", unsafe_allow_html=True)
                     st.markdown(f"<div class='result-header'><h3 style='color: #2E86C1;'>Allocation for {identifier}</h3></div>", unsafe_allow_html=True)
                     
-                    # Format the output for better readability
-                    formatted_result = result[["DEPARTMENT", "PROPORTION", "ALLOCATED_QUANTITY"]].copy()
-                    formatted_result = formatted_result.rename(columns={
-                        "DEPARTMENT": "Department",
-                        "PROPORTION": "Proportion (%)",
-                        "ALLOCATED_QUANTITY": "Allocated Quantity"
-                    })
-                    
-                    # Format numeric columns
-                    formatted_result["Proportion (%)"] = formatted_result["Proportion (%)"].round(2)
-                    formatted_result["Allocated Quantity"] = formatted_result["Allocated Quantity"].astype(int)
-                    
                     # Display the result
                     st.dataframe(formatted_result, use_container_width=True)
                     
@@ -539,7 +838,8 @@ with tab3:
         hist_items = st.multiselect("Filter by Specific Items (optional)", unique_item_names, default=[], key="hist_items")
     
     # Generate charts
-    charts = generate_usage_charts(data, hist_items, hist_departments, hist_date_range)
+    charts = generate_usage_charts(data, hist_items, hist_departments, hist_date_range,
+                                   usage_aggregates=st.session_state.usage_aggregates)
     
     # Display charts
     col1, col2 = st.columns(2)